@@ -123,6 +123,11 @@ config = dict(
     train=dict(
         forward_times=1,
         num_iters=90000,
+        # native mixed precision training (torch.cuda.amp)
+        amp=False,
+        channels_last=False,
+        # disable it if input shapes change across steps
+        cudnn_benchmark=False,
     ),
     test=dict(
     ),
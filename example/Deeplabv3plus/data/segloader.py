@@ -1,6 +1,7 @@
 from torch.utils.data.dataloader import DataLoader, default_collate
 from data import seg_data
 from simplecv import registry
+from simplecv.data.data_loader import worker_kwargs
 
 
 @registry.DATALOADER.register('segdataloader')
@@ -28,12 +29,12 @@ class SegDataLoader(DataLoader):
             shuffle=self.shuffle,
             sampler=None,
             batch_sampler=None,
-            num_workers=self.num_workers,
             collate_fn=default_collate,
             pin_memory=self.pin_memory,
             drop_last=self.drop_last,
             timeout=self.timeout,
             worker_init_fn=None,
+            **worker_kwargs(self.num_workers, self.persistent_workers, self.prefetch_factor)
         )
 
     def set_defalut_config(self):
@@ -47,7 +48,9 @@ class SegDataLoader(DataLoader):
             batch_size=1,
             shuffle=False,
             num_workers=0,
-            pin_memory=False,
+            persistent_workers=True,
+            prefetch_factor=4,
+            pin_memory=True,
             drop_last=False,
             timeout=0,
         ))
@@ -9,20 +9,23 @@ setup(
     name='simplecv',
     version='0.2.0',
     description='Simplify training, evaluation, prediction in Pytorch',
-    keywords='computer vision using pytorch 1.0',
+    keywords='computer vision using pytorch',
     packages=find_packages(),
     classifiers=[
         'Development Status :: 4 - Beta',
         'License :: OSI Approved :: Apache Software License',
         'Operating System :: OS Independent',
-        'Programming Language :: Python :: 3.5',
-        'Programming Language :: Python :: 3.6',
+        'Programming Language :: Python :: 3.8',
+        'Programming Language :: Python :: 3.9',
+        'Programming Language :: Python :: 3.10',
+        'Programming Language :: Python :: 3.11',
         'Topic :: Utilities',
     ],
     url='https://github.com/Z-Zheng/simplecv.git',
     author='Zhuo Zheng',
     author_email='zhuozheng_2017@163.com',
     license='GPLv3',
+    python_requires='>=3.8',
     setup_requires=[],
     tests_require=[],
     install_requires=install_requires,
@@ -8,6 +8,7 @@ from torch.optim.lr_scheduler import _LRScheduler
 from simplecv.opt.learning_rate import LearningRateBase
 from simplecv.util import param_util
 import functools
+import contextlib
 import types
 import torch
 from torch.nn.utils import clip_grad
@@ -34,6 +35,8 @@ class Launcher(object):
         self._optimizer = optimizer
         self._lr_schedule = lr_schedule
         self._master = get_rank() == 0
+        self._scaler = torch.amp.GradScaler('cuda', enabled=False)
+        self._channels_last = False
         self._logger = Logger('SimpleCV', use_tensorboard=self._master, tensorboard_logdir=model_dir)
         if self._master:
             self._logger.on()
@@ -66,6 +69,10 @@ class Launcher(object):
     def logger(self):
         return self._logger
 
+    @property
+    def scaler(self):
+        return self._scaler
+
     def compute_loss_gradient(self, data):
         """
 
@@ -80,19 +87,24 @@ class Launcher(object):
 
         loss_dict = {'total_loss': 0.0}
 
-        for d in data:
-            msg_dict = self._model(*d)
+        for idx, d in enumerate(data):
+            if self._channels_last:
+                d = to_channels_last(d)
+            # only all-reduce gradients after the last forward
+            with self._grad_sync_context(sync=idx == len(data) - 1):
+                with torch.autocast('cuda', enabled=self._scaler.is_enabled()):
+                    msg_dict = self._model(*d)
 
-            losses = {k: v for k, v in msg_dict.items() if k.endswith('loss')}
+                losses = {k: v for k, v in msg_dict.items() if k.endswith('loss')}
 
-            # scale losses by 1. / forward times
-            if len(data) != 1:
-                losses = scale_dict(losses, 1. / len(data))
+                # scale losses by 1. / forward times
+                if len(data) != 1:
+                    losses = scale_dict(losses, 1. / len(data))
 
-            losses = average_dict(losses)
-            total_loss = sum([e for e in losses.values()])
+                losses = average_dict(losses)
+                total_loss = sum([e for e in losses.values()])
 
-            self.backward(total_loss, self.optimizer)
+                self.backward(total_loss, self.optimizer)
 
             # log losses
             with torch.no_grad():
@@ -115,8 +127,14 @@ class Launcher(object):
 
         return loss_dict
 
+    def _grad_sync_context(self, sync=True):
+        if sync or not hasattr(self._model, 'no_sync'):
+            return contextlib.nullcontext()
+        return self._model.no_sync()
+
     def apply_gradient(self):
-        self._optimizer.step()
+        self._scaler.step(self._optimizer)
+        self._scaler.update()
         self._optimizer.zero_grad()
 
         self._update_lr()
@@ -149,6 +167,7 @@ class Launcher(object):
                                       is_master=self._master)
             self._model.train()
             loss_dict = self.compute_loss_gradient(data_list)
+            self._scaler.unscale_(self._optimizer)
             # clip gradient
             grad_clip_config = self._optimizer.simplecv_config.get('grad_clip', dict(max_norm=35, norm_type=2))
             clip_grad.clip_grad_norm_(filter(lambda p: p.requires_grad, self.model.module.parameters()),
@@ -170,10 +189,14 @@ class Launcher(object):
         forward_times = kwargs.get('forward_times', 1)
         iterator = Iterator(train_data_loader)
         for i in range(num_epochs):
+            iterator.set_seed_for_dist_sampler(i)
+            if i > 0:
+                iterator.reset()
             self._model.train()
             for data_list in iterator.iter(forward_times=forward_times):
                 start = time.time()
                 loss_dict = self.compute_loss_gradient(data_list)
+                self._scaler.unscale_(self._optimizer)
                 # clip gradient
                 grad_clip_config = self._optimizer.simplecv_config.get('grad_clip', dict(max_norm=35, norm_type=2))
                 clip_grad.clip_grad_norm_(filter(lambda p: p.requires_grad, self.model.module.parameters()),
@@ -196,12 +219,20 @@ class Launcher(object):
     def train_by_config(self, train_data_loader, config, test_data_loader=None, ):
         self.model.train()
         forward_times = config['forward_times'] if 'forward_times' in config else 1
+        if config.get('amp', False) and 'backward' in self.__dict__:
+            # e.g. apex amp_backward already returns unscaled gradients
+            raise ValueError('`amp` can not be used with an overridden backward.')
+        self._scaler = torch.amp.GradScaler('cuda', enabled=config.get('amp', False))
+        if self._scaler.is_enabled() and self._ckpt.scaler_state:
+            self._scaler.load_state_dict(self._ckpt.scaler_state)
+        self._channels_last = config.get('channels_last', False)
 
         if self._master:
             param_util.trainable_parameters(self.model)
             param_util.count_model_parameters(self.model)
             self._logger.equation('batch_size', train_data_loader.batch_sampler.batch_size)
             self._logger.forward_times(forward_times)
+            self._logger.info('[torch.amp] native amp: {}'.format('on' if self._scaler.is_enabled() else 'off'))
         if 'num_epochs' in config and 'num_iters' not in config:
             if self._master:
                 self._logger.equation('num_epochs', config['num_epochs'])
@@ -234,7 +265,7 @@ class Launcher(object):
         raise NotImplementedError
 
     def backward(self, total_loss, optimizer, **kwargs):
-        total_loss.backward()
+        self._scaler.scale(total_loss).backward()
 
     def override_evaluate(self, fn):
         self.evaluate = types.MethodType(fn, self)
@@ -253,3 +284,8 @@ def average_dict(input_dict):
     for k, v in input_dict.items():
         input_dict[k] = v.mean()
     return input_dict
+
+
+def to_channels_last(data):
+    return [v.contiguous(memory_format=torch.channels_last) if isinstance(v, torch.Tensor) and v.dim() == 4 else v
+            for v in data]
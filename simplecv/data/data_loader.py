@@ -9,3 +9,24 @@ def make_dataloader(config):
         raise ValueError('{} is not support now.'.format(dataloader_type))
 
     return data_loader
+
+
+def worker_kwargs(num_workers, persistent_workers=True, prefetch_factor=4):
+    """ keyword arguments of DataLoader for worker processes
+
+    persistent_workers and prefetch_factor are only valid with multi-process loading,
+    so they are dropped when num_workers is 0.
+
+    Args:
+        num_workers: int
+        persistent_workers: keep workers alive across epochs
+        prefetch_factor: number of batches loaded in advance by each worker
+
+    Returns:
+        dict
+    """
+    kwargs = dict(num_workers=num_workers)
+    if num_workers > 0:
+        kwargs.update(persistent_workers=persistent_workers,
+                      prefetch_factor=prefetch_factor)
+    return kwargs
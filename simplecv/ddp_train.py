@@ -29,10 +29,16 @@ def run(local_rank, config_path, model_dir, cpu_mode=False, after_construct_laun
     if not cpu_mode:
         if torch.cuda.is_available():
             torch.cuda.set_device(local_rank)
+            # autotune conv algorithms unless input shapes change across steps
+            torch.backends.cudnn.benchmark = cfg['train'].get('cudnn_benchmark', True)
+            torch.backends.cudnn.allow_tf32 = True
+            torch.backends.cuda.matmul.allow_tf32 = True
             dist.init_process_group(
                 backend="nccl", init_method="env://"
             )
         model.to(torch.device('cuda'))
+        if cfg['train'].get('channels_last', False):
+            model = model.to(memory_format=torch.channels_last)
         if dist.is_available():
             model = nn.parallel.DistributedDataParallel(
                 model, device_ids=[local_rank], output_device=local_rank,
@@ -1,6 +1,7 @@
+import warnings
+import torch
 import torch.nn as nn
 from torch.utils import checkpoint as cp
-from functools import partial
 from torchvision.models.resnet import resnet18
 from torchvision.models.resnet import resnet34
 from torchvision.models.resnet import resnet50
@@ -26,19 +27,49 @@ class ResNetEncoder(CVModule):
                 self.config['output_stride'] != 8]):
             raise ValueError('output_stride must be 8, 16 or 32.')
 
+        for stage_cp in self.config['with_cp']:
+            if stage_cp not in (False, True, 'block', 'every2'):
+                raise ValueError("with_cp must be a sequence of False, True, 'block' or 'every2'.")
+
         self.include_conv5 = self.config['include_conv5']
         self.resnet = registry.MODEL[self.config['resnet_type']](pretrained=self.config['pretrained'])
+        # forward never uses the classifier head
         self.resnet._modules.pop('fc')
+        self.resnet._modules.pop('avgpool')
+        if not self.include_conv5:
+            self.resnet._modules.pop('layer4')
         if not self.config['batchnorm_trainable']:
             self._frozen_res_bn()
 
         self._freeze_at(at=self.config['freeze_at'])
 
+        if self.config['fuse_frozen_bn'] and not self.config['batchnorm_trainable']:
+            param_util.fuse_frozen_bn(self.resnet)
+
         if self.config['output_stride'] == 16:
-            self.resnet.layer4.apply(partial(self._nostride_dilate, dilate=2))
+            if self.include_conv5:
+                self._nostride_dilate(self.resnet.layer4, dilate=2)
         elif self.config['output_stride'] == 8:
-            self.resnet.layer3.apply(partial(self._nostride_dilate, dilate=2))
-            self.resnet.layer4.apply(partial(self._nostride_dilate, dilate=4))
+            self._nostride_dilate(self.resnet.layer3, dilate=2)
+            if self.include_conv5:
+                self._nostride_dilate(self.resnet.layer4, dilate=4)
+
+        # pick the forward once instead of branching on include_conv5 every step
+        self.forward = self._forward_5stage if self.include_conv5 else self._forward_4stage
+
+        if self.config['torch_compile']:
+            self._compile()
+
+    def _compile(self):
+        # checkpointing breaks cuda graph capture, so keep the eager forward
+        if any(self.with_cp[:4 if self.include_conv5 else 3]):
+            warnings.warn('ResNetEncoder is not compiled because with_cp is enabled.')
+            return
+        if not hasattr(nn.Module, 'compile'):
+            warnings.warn('ResNetEncoder is not compiled because nn.Module.compile requires PyTorch >= 2.2.')
+            return
+        # compile in place to keep the parameter names of state_dict
+        self.compile(mode='reduce-overhead', fullgraph=False)
 
     def _frozen_res_bn(self):
         param_util.freeze_modules(self.resnet, nn.BatchNorm2d)
@@ -59,18 +90,36 @@ class ResNetEncoder(CVModule):
 
         if at >= 4:
             param_util.freeze_params(self.resnet.layer3)
-        if at >= 5:
+        if at >= 5 and self.include_conv5:
             param_util.freeze_params(self.resnet.layer4)
 
     @staticmethod
-    def get_function(module):
-        def _function(x):
-            y = module(x)
-            return y
-
-        return _function
+    def _forward_stage(stage, x, with_cp):
+        """ forward a resnet stage with optional gradient checkpointing
+
+        Args:
+            stage: nn.Sequential of residual blocks
+            x: input tensor
+            with_cp: False, True (checkpoint the whole stage),
+                'block' (checkpoint each block) or 'every2' (checkpoint every second block)
+
+        Returns:
+
+        """
+        if not with_cp or not torch.is_grad_enabled():
+            return stage(x)
+        if with_cp is True:
+            return cp.checkpoint(stage, x, use_reentrant=False)
+
+        interval = 1 if with_cp == 'block' else 2
+        for idx, block in enumerate(stage):
+            if idx % interval == 0:
+                x = cp.checkpoint(block, x, use_reentrant=False)
+            else:
+                x = block(x)
+        return x
 
-    def forward(self, inputs):
+    def _forward_4stage(self, inputs):
         x = inputs
         x = self.resnet.conv1(x)
         x = self.resnet.bn1(x)
@@ -78,30 +127,20 @@ class ResNetEncoder(CVModule):
         x = self.resnet.maxpool(x)
 
         # os 4, #layers/outdim: 18,34/64; 50,101,152/256
-        if self.with_cp[0] and x.requires_grad:
-            c2 = cp.checkpoint(self.get_function(self.resnet.layer1), x)
-        else:
-            c2 = self.resnet.layer1(x)
+        c2 = self._forward_stage(self.resnet.layer1, x, self.with_cp[0])
         # os 8, #layers/outdim: 18,34/128; 50,101,152/512
-        if self.with_cp[1] and c2.requires_grad:
-            c3 = cp.checkpoint(self.get_function(self.resnet.layer2), c2)
-        else:
-            c3 = self.resnet.layer2(c2)
+        c3 = self._forward_stage(self.resnet.layer2, c2, self.with_cp[1])
         # os 16, #layers/outdim: 18,34/256; 50,101,152/1024
-        if self.with_cp[2] and c3.requires_grad:
-            c4 = cp.checkpoint(self.get_function(self.resnet.layer3), c3)
-        else:
-            c4 = self.resnet.layer3(c3)
-        # os 32, #layers/outdim: 18,34/512; 50,101,152/2048
-        if self.include_conv5:
-            if self.with_cp[3] and c4.requires_grad:
-                c5 = cp.checkpoint(self.get_function(self.resnet.layer4), c4)
-            else:
-                c5 = self.resnet.layer4(c4)
-            return [c2, c3, c4, c5]
+        c4 = self._forward_stage(self.resnet.layer3, c3, self.with_cp[2])
 
         return [c2, c3, c4]
 
+    def _forward_5stage(self, inputs):
+        feat_list = self._forward_4stage(inputs)
+        # os 32, #layers/outdim: 18,34/512; 50,101,152/2048
+        feat_list.append(self._forward_stage(self.resnet.layer4, feat_list[-1], self.with_cp[3]))
+        return feat_list
+
     def set_defalut_config(self):
         self.config.update(dict(
             resnet_type='resnet50',
@@ -109,24 +148,38 @@ class ResNetEncoder(CVModule):
             batchnorm_trainable=True,
             pretrained=True,
             freeze_at=0,
+            # fold frozen bn into frozen conv when batchnorm_trainable=False,
+            # it fixes bn to running stats in training and drops bn keys from state_dict
+            fuse_frozen_bn=False,
             # 16 or 32
             output_stride=32,
+            # per stage: False, True, 'block' or 'every2'
             with_cp=(False, False, False, False),
+            # torch.compile the forward, ignored when with_cp is enabled
+            torch_compile=False,
         ))
 
-    def _nostride_dilate(self, m, dilate):
+    @staticmethod
+    def _nostride_dilate(layer, dilate):
         # ref:
         # https://github.com/CSAILVision/semantic-segmentation-pytorch/blob/1235deb1d68a8f3ef87d639b95b2b8e3607eea4c/models/models.py#L256
-        classname = m.__class__.__name__
-        if classname.find('Conv') != -1:
+        # a stride-2 conv dilated by 2 looks like an untouched conv, so mark the stage to make this idempotent
+        if getattr(layer, '_nostride_dilated', False):
+            return
+        half_dilate = (dilate // 2, dilate // 2)
+        full_dilate = (dilate, dilate)
+        for m in layer.modules():
+            if not isinstance(m, nn.Conv2d):
+                continue
+            is_3x3 = m.kernel_size[0] == 3
             # the convolution with stride
-            if m.stride == (2, 2):
+            if m.stride[0] == 2:
                 m.stride = (1, 1)
-                if m.kernel_size == (3, 3):
-                    m.dilation = (dilate // 2, dilate // 2)
-                    m.padding = (dilate // 2, dilate // 2)
+                if is_3x3:
+                    m.dilation = half_dilate
+                    m.padding = half_dilate
             # other convoluions
-            else:
-                if m.kernel_size == (3, 3):
-                    m.dilation = (dilate, dilate)
-                    m.padding = (dilate, dilate)
+            elif is_3x3:
+                m.dilation = full_dilate
+                m.padding = full_dilate
+        layer._nostride_dilated = True
@@ -11,12 +11,14 @@ class CheckPoint(object):
     MODEL = 'model'
     OPTIMIZER = 'opt'
     GLOBALSTEP = 'global_step'
+    SCALER = 'scaler'
     LASTCHECKPOINT = 'last'
     CHECKPOINT_NAME = 'checkpoint_info.json'
 
     def __init__(self, launcher=None):
         self._launcher = launcher
         self._global_step = 0
+        self._scaler_state = None
         self._json_log = {CheckPoint.LASTCHECKPOINT: dict(
             step=0,
             name=''),
@@ -33,6 +35,10 @@ class CheckPoint(object):
     def global_step(self):
         return self._global_step
 
+    @property
+    def scaler_state(self):
+        return self._scaler_state
+
     def step(self):
         self._global_step += 1
 
@@ -44,7 +50,8 @@ class CheckPoint(object):
         ckpt = OrderedDict({
             CheckPoint.MODEL: self._launcher.model.state_dict(),
             CheckPoint.OPTIMIZER: self._launcher.optimizer.state_dict(),
-            CheckPoint.GLOBALSTEP: self.global_step
+            CheckPoint.GLOBALSTEP: self.global_step,
+            CheckPoint.SCALER: self._launcher.scaler.state_dict(),
         })
         filename = self.get_checkpoint_name(self.global_step)
         filepath = os.path.join(self._launcher.model_dir, filename)
@@ -92,6 +99,8 @@ class CheckPoint(object):
             self._launcher.optimizer.load_state_dict(ckpt[CheckPoint.OPTIMIZER])
         if self._launcher.checkpoint is not None:
             self._launcher.checkpoint.set_global_step(ckpt[CheckPoint.GLOBALSTEP])
+        # the GradScaler is built by train_by_config, which loads this state
+        self._scaler_state = ckpt.get(CheckPoint.SCALER)
         # log
         restore_log(logger, last_path)
 
@@ -1,7 +1,9 @@
 import logging
+import math
 import time
 import tensorboardX
 import numpy as np
+import torch
 from collections import deque
 
 logging.basicConfig(level=logging.INFO)
@@ -14,6 +16,8 @@ def get_logger(name=__name__):
 
 
 class Logger(object):
+    HIST_BINS = 512
+
     def __init__(self,
                  name,
                  level=logging.INFO,
@@ -28,6 +32,9 @@ class Logger(object):
         if self.use_tensorboard:
             self.summary_w = tensorboardX.SummaryWriter(log_dir=tensorboard_logdir)
         self.smoothvalues = dict()
+        # pinned host buffers of packed histogram stats and counts, allocated on first summary
+        self._hist_buf = dict()
+        self._trainable_params = None
 
     def create_or_get_smoothvalues(self, loss_dict):
         for key, value in loss_dict.items():
@@ -48,72 +55,125 @@ class Logger(object):
         self._logger.setLevel(100)
         self.use_tensorboard = False
 
+    def refresh_param_cache(self, module):
+        """ re-collect the trainable parameters of module, call it after freezing or unfreezing parameters
+
+        Args:
+            module: nn.Module
+
+        Returns:
+
+        """
+        self._trainable_params = [(name, p) for name, p in module.named_parameters() if p.requires_grad]
+
     def summary_weights(self, module, step):
-        if step % 100 == 0:
-            for name, p in module.named_parameters():
-                if not p.requires_grad:
-                    continue
-                self.summary_w.add_histogram('weights/{}'.format(name), p.cpu().data.numpy(), step)
+        if self.use_tensorboard and step % 100 == 0:
+            if self._trainable_params is None:
+                self.refresh_param_cache(module)
+            self._summary_histograms('weights', self._trainable_params, step)
 
     def summary_grads(self, module, step):
-        if step % 100 == 0:
-            for name, p in module.named_parameters():
-                if not p.requires_grad:
+        if self.use_tensorboard and step % 100 == 0:
+            if self._trainable_params is None:
+                self.refresh_param_cache(module)
+            named_tensors = [(name, p.grad) for name, p in self._trainable_params if p.grad is not None]
+            self._summary_histograms('grads', named_tensors, step)
+
+    def _summary_histograms(self, prefix, named_tensors, step):
+        """ compute histograms on the tensors' device, stats and counts are copied to host in two transfers
+
+        Args:
+            prefix: tag prefix, e.g. 'weights' or 'grads'
+            named_tensors: list of (name, tensor)
+            step: global step
+
+        Returns:
+
+        """
+        if len(named_tensors) == 0:
+            return
+        with torch.no_grad():
+            tensors = [t.detach().float() for _, t in named_tensors]
+            # 1. stats of all tensors in one transfer, histc needs min/max on host to avoid a sync per tensor
+            stats = torch.stack([torch.stack([t.min(), t.max(), t.sum(), (t * t).sum(),
+                                              torch.isfinite(t).all().float()]) for t in tensors])
+            stats = self._copy_to_host('{}/stats'.format(prefix), stats).tolist()
+            # 2. histograms of finite tensors in one transfer, histc raises on inf/nan (e.g. amp overflow grads)
+            valid = []
+            counts = []
+            for idx, (t, (t_min, t_max, _, _, finite)) in enumerate(zip(tensors, stats)):
+                if not finite:
                     continue
-                self.summary_w.add_histogram('grads/{}'.format(name), p.grad.cpu().data.numpy(), step)
+                # same range as histc uses for constant tensors
+                low, high = (t_min - 1, t_max + 1) if t_min == t_max else (t_min, t_max)
+                counts.append(torch.histc(t, bins=self.HIST_BINS, min=low, max=high))
+                valid.append((idx, low, high))
+            if len(valid) == 0:
+                return
+            counts = self._copy_to_host('{}/counts'.format(prefix), torch.stack(counts)).numpy()
+
+        for (idx, low, high), row in zip(valid, counts):
+            t_min, t_max, t_sum, t_sum_squares, _ = stats[idx]
+            self.summary_w.add_histogram_raw('{}/{}'.format(prefix, named_tensors[idx][0]), min=t_min, max=t_max,
+                                             num=tensors[idx].numel(), sum=t_sum, sum_squares=t_sum_squares,
+                                             bucket_limits=np.linspace(low, high, self.HIST_BINS + 1)[1:].tolist(),
+                                             bucket_counts=row.tolist(),
+                                             global_step=step)
+
+    def _copy_to_host(self, key, tensor):
+        buf = self._hist_buf.get(key)
+        if buf is None or buf.shape != tensor.shape:
+            buf = torch.empty(tensor.shape, pin_memory=tensor.is_cuda)
+            self._hist_buf[key] = buf
+        buf.copy_(tensor, non_blocking=True)
+        if tensor.is_cuda:
+            torch.cuda.current_stream(tensor.device).synchronize()
+        return buf
 
     def train_log(self, step, loss_dict, time_cost, lr, metric_dict=None):
+        if not self.use_tensorboard and not self._logger.isEnabledFor(logging.INFO):
+            # keep smoothed values up to date for when the logger is turned on
+            self.create_or_get_smoothvalues(loss_dict)
+            return
         smooth_loss_dict = self.create_or_get_smoothvalues(loss_dict)
-        loss_info = ''.join(
-            ['{name} = {value}\t'.format(name=name, value=str(round(value, 6)).ljust(6, '0')) for name, value in
-             smooth_loss_dict.items()])
-        step_info = 'step: {}\t'.format(int(step))
-        time_cost_info = '({} sec / step)'.format(round(time_cost, 3))
+        loss_info = ''.join(['{} = {:.6f}\t'.format(name, value) for name, value in smooth_loss_dict.items()])
+        step_info = 'step: {:d}\t'.format(int(step))
+        time_cost_info = '({:.3f} sec / step)'.format(time_cost)
 
         if metric_dict:
             metric_info = ''.join(
-                ['[Train] {name} = {value}\t'.format(name=name, value=np.round(value, 6)) for name, value in
-                 metric_dict.items()])
+                ['[Train] {} = {}\t'.format(name, format_metric(value)) for name, value in metric_dict.items()])
         else:
             metric_info = ''
-        lr_info = 'lr = {}\t'.format(str(round(lr, 6)))
-        msg = '{loss}{metric}{lr}{step}{time}'.format(loss=loss_info, metric=metric_info, step=step_info,
-                                                      lr=lr_info,
-                                                      time=time_cost_info)
-        self._logger.info(msg)
+        lr_info = 'lr = {:.6f}\t'.format(lr)
+        self._logger.info(loss_info + metric_info + lr_info + step_info + time_cost_info)
 
         if self.use_tensorboard and step % 100 == 0:
             self.train_summary(step, smooth_loss_dict, time_cost, lr, metric_dict)
 
     def train_summary(self, step, loss_dict, time_cost, lr, metric_dict=None):
-        for name, value in loss_dict.items():
-            self.summary_w.add_scalar('loss/{}'.format(name), float(value), global_step=step)
+        scalars = {'loss/{}'.format(name): float(value) for name, value in loss_dict.items()}
         if metric_dict:
-            for name, value in metric_dict.items():
-                if isinstance(value, float):
-                    self.summary_w.add_scalar('train/{}'.format(name), value, global_step=step)
-                elif isinstance(value, np.ndarray):
-                    for idx, nd_v in enumerate(value):
-                        self.summary_w.add_scalar('train/{}_{}'.format(name, idx), float(nd_v), global_step=step)
+            scalars.update(flatten_metric_dict('train', metric_dict))
+        scalars['sec_per_step'] = float(time_cost)
+        scalars['learning_rate'] = float(lr)
+        self._add_scalar_dict(scalars, step)
 
-        self.summary_w.add_scalar('sec_per_step', float(time_cost), global_step=step)
-        self.summary_w.add_scalar('learning_rate', float(lr), global_step=step)
+    def _add_scalar_dict(self, scalars, step):
+        walltime = time.time()
+        for tag, value in scalars.items():
+            self.summary_w.add_scalar(tag, value, global_step=step, walltime=walltime)
 
     def eval_log(self, metric_dict, step=None):
         for name, value in metric_dict.items():
-            self._logger.info('[Eval] {name} = {value}'.format(name=name, value=np.round(value, 6)))
+            self._logger.info('[Eval] {} = {}'.format(name, format_metric(value)))
         if self.use_tensorboard:
             self.eval_summary(metric_dict, step)
 
     def eval_summary(self, metric_dict, step):
         if step is None:
             step = 1
-        for name, value in metric_dict.items():
-            if isinstance(value, float):
-                self.summary_w.add_scalar('eval/{}'.format(name), value, global_step=step)
-            elif isinstance(value, np.ndarray):
-                for idx, nd_v in enumerate(value):
-                    self.summary_w.add_scalar('eval/{}_{}'.format(name, idx), float(nd_v), global_step=step)
+        self._add_scalar_dict(flatten_metric_dict('eval', metric_dict), step)
 
     def forward_times(self, forward_times):
         self._logger.info('use {} forward and {} backward mode.'.format(forward_times, forward_times))
@@ -125,6 +185,32 @@ class Logger(object):
         self._logger.info('{name} ~= {value}'.format(name=name, value=value))
 
 
+def format_metric(value):
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return np.array2string(np.asarray(value), precision=6, floatmode='fixed')
+    return '{:.6f}'.format(float(value))
+
+
+def flatten_metric_dict(prefix, metric_dict):
+    """ flatten float and np.ndarray metrics into {tag: float}, the i-th element of an array is tagged as name_i
+
+    Args:
+        prefix: tag prefix, e.g. 'train' or 'eval'
+        metric_dict: dict of float or np.ndarray
+
+    Returns:
+        dict
+    """
+    scalars = dict()
+    for name, value in metric_dict.items():
+        if isinstance(value, float):
+            scalars['{}/{}'.format(prefix, name)] = value
+        elif isinstance(value, np.ndarray):
+            for idx, nd_v in enumerate(value.ravel().tolist()):
+                scalars['{}/{}_{}'.format(prefix, name, idx)] = nd_v
+    return scalars
+
+
 def save_log(logger, checkpoint_name):
     logger.info('{} has been saved.'.format(checkpoint_name))
 
@@ -152,15 +238,24 @@ class SmoothedValue(object):
     window or the global series average.
     """
 
-    def __init__(self, window_size):
+    def __init__(self, window_size, keep_series=False, series_size=10000):
         self.deque = deque(maxlen=window_size)
-        self.series = []
+        # the most recent `series_size` values, only kept on demand
+        self.series = deque(maxlen=series_size) if keep_series else None
         self.total = 0.0
         self.count = 0
+        self._window_sum = 0.0
 
     def add_value(self, value):
+        if len(self.deque) == self.deque.maxlen:
+            self._window_sum -= self.deque[0]
         self.deque.append(value)
-        self.series.append(value)
+        self._window_sum += value
+        if not math.isfinite(self._window_sum):
+            # inf - inf leaves nan after an inf value is evicted, recompute from the window
+            self._window_sum = sum(self.deque)
+        if self.series is not None:
+            self.series.append(value)
         self.count += 1
         self.total += value
 
@@ -168,7 +263,7 @@ class SmoothedValue(object):
         return np.median(self.deque)
 
     def get_average_value(self):
-        return np.mean(self.deque)
+        return self._window_sum / len(self.deque)
 
     def get_global_average_value(self):
         return self.total / self.count
@@ -1,5 +1,8 @@
 from simplecv.util.logger import get_logger
 from functools import reduce
+from itertools import chain
+import torch.nn as nn
+from torch.nn.utils.fusion import fuse_conv_bn_eval
 
 logger = get_logger(__name__)
 
@@ -38,3 +41,29 @@ def freeze_modules(module, specific_class=None):
                 continue
         freeze_params(m)
 
+
+def fuse_frozen_bn(module):
+    """ fold each frozen BatchNorm2d into its preceding frozen Conv2d and replace the BatchNorm2d with nn.Identity
+
+    Args:
+        module: nn.Module
+
+    Returns:
+        the number of fused (Conv2d, BatchNorm2d) pairs
+    """
+    cnt = 0
+    for m in list(module.modules()):
+        names = list(m._modules.keys())
+        for conv_name, bn_name in zip(names[:-1], names[1:]):
+            conv, bn = m._modules[conv_name], m._modules[bn_name]
+            if not isinstance(conv, nn.Conv2d) or not isinstance(bn, nn.BatchNorm2d):
+                continue
+            if not bn.track_running_stats or any(p.requires_grad for p in chain(conv.parameters(), bn.parameters())):
+                continue
+            fused_conv = fuse_conv_bn_eval(conv.eval(), bn.eval())
+            freeze_params(fused_conv)
+            m._modules[conv_name] = fused_conv
+            m._modules[bn_name] = nn.Identity()
+            cnt += 1
+    logger.info('[fuse frozen bn] {} pairs'.format(cnt))
+    return cnt